@@ -31,14 +31,19 @@ os.environ["TZ"] = "Asia/Hong_Kong"
 time.tzset()
 
 
+# Set by the signal handler, acted on by the main loop. The handler must not
+# notify or disconnect itself: it can interrupt the main thread while it holds
+# the notification queue's lock, and re-entering it would deadlock.
+_shutdown_requested = False
+
+
 def setup_signal_handlers() -> None:
     """Setup graceful shutdown handlers."""
 
     def shutdown_handler(signum, frame):
+        global _shutdown_requested
         logger.info("Shutdown signal received")
-        telegram_notifier.notify_shutdown()
-        futu_trader.disconnect()
-        sys.exit(0)
+        _shutdown_requested = True
 
     signal.signal(signal.SIGTERM, shutdown_handler)
     signal.signal(signal.SIGINT, shutdown_handler)
@@ -62,6 +67,21 @@ def setup_schedule() -> None:
     logger.info(f"Scheduled price check every {config.PRICE_CHECK_INTERVAL_MINUTES} minutes")
 
 
+def sleep_unless_shutdown(seconds: int) -> None:
+    """Sleep in one-second steps so a shutdown request is noticed promptly."""
+    for _ in range(seconds):
+        if _shutdown_requested:
+            return
+        time.sleep(1)
+
+
+def shutdown() -> None:
+    """Notify and release resources before exiting."""
+    logger.info("Shutting down...")
+    telegram_notifier.notify_shutdown()
+    futu_trader.disconnect()
+
+
 def ensure_directories() -> None:
     """Ensure required directories exist."""
     Path("/app/data").mkdir(parents=True, exist_ok=True)
@@ -144,14 +164,16 @@ def main() -> None:
 
     # Main loop
     logger.info("Entering main loop...")
-    while True:
+    while not _shutdown_requested:
         try:
             schedule.run_pending()
-            time.sleep(60)  # Check every minute
+            sleep_unless_shutdown(60)  # Check every minute
         except Exception as e:
             logger.error(f"Error in main loop: {e}")
             telegram_notifier.notify_error(f"Main loop error: {e}")
-            time.sleep(60)
+            sleep_unless_shutdown(60)
+
+    shutdown()
 
 
 if __name__ == "__main__":
@@ -1,94 +1,316 @@
 """Telegram notification module."""
 
+import atexit
 import html
+import json
 import logging
+import queue
+import threading
 import time
 from typing import Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 from config import config
 
+__all__ = ["TelegramNotifier", "telegram_notifier"]
+
 logger = logging.getLogger(__name__)
 
-MAX_RETRIES = 5
-MIN_SEND_INTERVAL = 0.5  # Minimum seconds between messages
+MAX_RETRIES = 5  # Total attempts per message, including the first
+MAX_BACKOFF = 10.0  # Cap on retry delay (seconds)
+RATE_LIMIT_CAPACITY = 20  # Burst size (tokens)
+RATE_LIMIT_REFILL = 1.0  # Tokens added per second
+QUEUE_MAXSIZE = 1000  # Pending notifications before new ones are dropped
+SHUTDOWN_TIMEOUT = 30  # Seconds to wait for the queue to drain on close
+COALESCE_WINDOW = 0.1  # Seconds to wait for more messages to batch together
+COALESCE_MAX = 10  # Maximum messages merged into one send
+MAX_MESSAGE_LENGTH = 4096  # Telegram sendMessage text limit
+BATCH_SEPARATOR = "\n\n━━━━━\n\n"
+
+# Outcomes of a single send attempt
+SEND_OK = "ok"
+SEND_REJECTED = "rejected"  # Telegram answered 400, e.g. malformed HTML
+SEND_FAILED = "failed"  # Transport error or retries exhausted
+
+
+def _esc(s: str) -> str:
+    """Escape text for Telegram's HTML parse mode."""
+    return html.escape(s, quote=False) if s else s
 
 
 class TelegramNotifier:
     """Telegram bot for sending notifications."""
 
+    # Static message templates, parsed once instead of per-call f-strings
+    _TRADE_TMPL = (
+        "{emoji} <b>{title}</b>\n"
+        "\n"
+        "<b>Ticker:</b> {ticker}\n"
+        "<b>Action:</b> {action}\n"
+        "<b>Quantity:</b> {quantity} shares\n"
+        "<b>Price:</b> ${price:.2f}\n"
+        "<b>Total:</b> ${total:,.2f}"
+    )
+    _PNL_TMPL = (
+        "\n<b>Avg Cost:</b> ${avg_cost:.2f}"
+        "\n<b>P&amp;L:</b> {emoji} {sign}${pnl:,.2f} ({sign}{pnl_pct:.1f}%)"
+    )
+    _AI_SCORE_LINE = "\n<b>AI Score:</b> {ai_score}/10"
+    _REASON_LINE = "\n<b>Reason:</b> {reason}"
+    _SIGNAL_TMPL = (
+        "{emoji} <b>Trading Signal: {signal_type}</b>\n"
+        "\n"
+        "<b>Ticker:</b> {ticker}\n"
+        "<b>AI Score:</b> {ai_score}/10"
+    )
+    _CURRENT_PRICE_LINE = "\n<b>Current Price:</b> ${price:.2f}"
+    _TARGET_PRICE_LINE = "\n<b>Target Price:</b> ${price:.2f}"
+    _ERROR_TMPL = "⚠️ <b>Trading System Error</b>\n\n{msg}"
+    _SUMMARY_TMPL = (
+        "📊 <b>Daily Summary</b>\n"
+        "\n"
+        "<b>Total Value:</b> ${total_value:,.2f}\n"
+        "<b>Daily P&amp;L:</b> {emoji} {sign}${daily_pnl:,.2f}\n"
+        "<b>Positions:</b> {count}"
+    )
+    _HOLDINGS_HEADER = "\n\n<b>Holdings:</b>"
+    _HOLDING_LINE = "\n  • {ticker}: {quantity} shares"
+    _HOLDINGS_MORE = "\n  ... and {count} more"
+    _STARTUP_TMPL = "{emoji} <b>Trading System Started</b>\n\n<b>Mode:</b> {mode}\n<b>Status:</b> Running"
+    _SHUTDOWN_MSG = "🛑 <b>Trading System Stopped</b>\n\nThe trading system has been shut down."
+
     def __init__(
         self,
         bot_token: Optional[str] = None,
         chat_id: Optional[str] = None,
     ):
         self.bot_token = bot_token or config.TELEGRAM_BOT_TOKEN
-        self.chat_id = chat_id or config.TELEGRAM_CHAT_ID
+        self.chat_id = str(chat_id or config.TELEGRAM_CHAT_ID)
         self.base_url = f"https://api.telegram.org/bot{self.bot_token}"
-        self._last_send_time: float = 0
+        self._send_url = f"{self.base_url}/sendMessage"
+        self._base_payload = {"chat_id": self.chat_id, "parse_mode": "HTML"}
+
+        # Token bucket rate limiter: bursts pass, sustained traffic is throttled
+        self._capacity = RATE_LIMIT_CAPACITY
+        self._refill_rate = RATE_LIMIT_REFILL
+        self._tokens: float = self._capacity
+        self._last_refill: float = time.monotonic()
+        self._rate_lock = threading.Lock()
+
+        # Reuse the TCP/TLS connection to api.telegram.org across messages;
+        # urllib3 handles retries, jittered backoff and 429 Retry-After
+        retry = Retry(
+            total=MAX_RETRIES - 1,  # urllib3 counts retries, not attempts
+            backoff_factor=1.0,
+            backoff_jitter=0.5,
+            backoff_max=MAX_BACKOFF,
+            status_forcelist=(429, 500, 502, 503, 504),
+            respect_retry_after_header=True,
+            allowed_methods=frozenset(["POST"]),
+        )
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=4,
+            pool_block=False,
+            max_retries=retry,
+        )
+        self._session.mount("https://", adapter)
+        self._session.headers["Content-Type"] = "application/json"
+
+        # Callers only enqueue; a single worker owns the session and rate limiter
+        # Items are (kind, fields); formatting happens on the worker, not the caller
+        self._q: queue.Queue[Optional[tuple[str, dict]]] = queue.Queue(maxsize=QUEUE_MAXSIZE)
+        self._worker = threading.Thread(target=self._drain, name="telegram-notifier", daemon=True)
+        self._closed = False
+
+        # Configuration is fixed after construction, so decide once here
+        self._accepting = bool(self.bot_token and self.chat_id)
+        if not self._accepting:
+            logger.warning("Telegram not configured, notifications are disabled")
+        else:
+            self._worker.start()
+            # The worker is a daemon thread, so flush the queue before the
+            # interpreter exits (e.g. notify_error() followed by sys.exit())
+            atexit.register(self.close)
+
+    def close(self) -> None:
+        """Flush pending messages, stop the worker and close the HTTP session."""
+        if self._closed:
+            return
+        self._closed = True
+        # Nothing will read the queue after the sentinel, so refuse new items
+        self._accepting = False
+        if self._worker.is_alive():
+            try:
+                self._q.put(None, timeout=SHUTDOWN_TIMEOUT)
+            except queue.Full:
+                logger.warning("Telegram queue full on shutdown, dropping pending messages")
+            self._worker.join(timeout=SHUTDOWN_TIMEOUT)
+            if self._worker.is_alive():
+                logger.warning("Telegram worker did not finish within shutdown timeout")
+        self._session.close()
+
+    def _drain(self) -> None:
+        """Worker loop: deliver queued messages until the sentinel arrives."""
+        while True:
+            item = self._q.get()
+            if item is None:
+                return
+
+            # Collect messages arriving within the window into one batch
+            batch = [item]
+            stopping = False
+            deadline = time.monotonic() + COALESCE_WINDOW
+            while len(batch) < COALESCE_MAX:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._q.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            messages = []
+            for kind, fields in batch:
+                try:
+                    messages.append(self._format(kind, fields))
+                except Exception as e:
+                    logger.error(f"Failed to format Telegram {kind} notification: {e}")
+
+            for group, parse_mode in self._coalesce(messages):
+                self._send_group(group, parse_mode)
+
+            if stopping:
+                return
+
+    def _format(self, kind: str, fields: dict) -> tuple[str, str]:
+        """Turn a queued (kind, fields) item into (message, parse_mode)."""
+        if kind == "text":
+            return fields["message"], fields["parse_mode"]
+        return getattr(self, f"_format_{kind}")(**fields), "HTML"
+
+    @staticmethod
+    def _coalesce(batch: list[tuple[str, str]]) -> list[tuple[list[str], str]]:
+        """Group consecutive messages sharing a parse mode, within Telegram's length limit."""
+        groups: list[tuple[list[str], str]] = []
+        length = 0
+        for message, parse_mode in batch:
+            if groups:
+                group, group_mode = groups[-1]
+                joined_length = length + len(BATCH_SEPARATOR) + len(message)
+                if group_mode == parse_mode and joined_length <= MAX_MESSAGE_LENGTH:
+                    group.append(message)
+                    length = joined_length
+                    continue
+            groups.append(([message], parse_mode))
+            length = len(message)
+        return groups
+
+    def _send_group(self, group: list[str], parse_mode: str) -> None:
+        """Send a group as one message, falling back to one send per message on a 400."""
+        status = self._try_deliver(BATCH_SEPARATOR.join(group), parse_mode)
+        if status == SEND_OK:
+            return
+        if status == SEND_REJECTED and len(group) > 1:
+            # One bad message must not take the rest of the batch down with it.
+            # Transport failures are not split: urllib3 already spent the retry
+            # budget, and the batch may have been delivered despite a timeout.
+            logger.warning(f"Telegram rejected batch of {len(group)} notifications, sending individually")
+            failed = sum(self._try_deliver(message, parse_mode) != SEND_OK for message in group)
+        else:
+            failed = len(group)
+        if failed:
+            logger.error(f"Dropped {failed} of {len(group)} Telegram notifications")
+
+    def _try_deliver(self, message: str, parse_mode: str) -> str:
+        """Call _deliver, treating unexpected errors as a failed send."""
+        try:
+            return self._deliver(message, parse_mode)
+        except Exception as e:
+            logger.error(f"Unexpected error in Telegram worker: {e}")
+            return SEND_FAILED
+
+    def _acquire_token(self) -> None:
+        """Take one token from the bucket, sleeping if it is empty."""
+        with self._rate_lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self._capacity,
+                self._tokens + (now - self._last_refill) * self._refill_rate,
+            )
+            self._last_refill = now
+            # Reserve the token now so concurrent callers queue up behind us
+            self._tokens -= 1
+            wait = -self._tokens / self._refill_rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+    @staticmethod
+    def _render(template: str, **fields) -> str:
+        """Format a template, HTML-escaping every string field."""
+        return template.format_map(
+            {k: _esc(v) if isinstance(v, str) else v for k, v in fields.items()}
+        )
 
     def send_message(self, message: str, parse_mode: str = "HTML") -> bool:
         """
-        Send a message to Telegram with rate limiting.
+        Queue a message for delivery to Telegram.
 
         Args:
             message: Message text
             parse_mode: "HTML" or "Markdown"
 
         Returns:
-            True if sent successfully.
+            True if queued successfully.
         """
-        if not self.bot_token or not self.chat_id:
-            logger.warning("Telegram not configured, skipping notification")
-            return False
+        return self._enqueue("text", {"message": message, "parse_mode": parse_mode})
 
-        # Rate limiting: ensure minimum interval between messages
-        elapsed = time.time() - self._last_send_time
-        if elapsed < MIN_SEND_INTERVAL:
-            time.sleep(MIN_SEND_INTERVAL - elapsed)
-
-        url = f"{self.base_url}/sendMessage"
-        payload = {
-            "chat_id": self.chat_id,
-            "text": message,
-            "parse_mode": parse_mode,
-        }
-
-        for attempt in range(MAX_RETRIES):
-            try:
-                response = requests.post(url, data=payload, timeout=10)
-                response.raise_for_status()
-                self._last_send_time = time.time()
-                logger.debug(f"Telegram message sent: {message[:50]}...")
-                return True
-            except requests.exceptions.HTTPError as e:
-                if e.response.status_code == 429:
-                    # Rate limited - get retry_after from response
-                    try:
-                        retry_after = e.response.json().get("parameters", {}).get("retry_after", 5)
-                    except Exception:
-                        retry_after = 5 * (attempt + 1)
-                    logger.warning(f"Telegram rate limited (429), waiting {retry_after}s...")
-                    time.sleep(retry_after)
-                elif attempt < MAX_RETRIES - 1:
-                    delay = 2 ** attempt  # Exponential backoff: 1, 2, 4, 8, 16s
-                    logger.warning(f"Telegram send failed, retrying in {delay}s: {e}")
-                    time.sleep(delay)
-                else:
-                    logger.error(f"Failed to send Telegram message after {MAX_RETRIES} attempts: {e}")
-                    return False
-            except requests.exceptions.RequestException as e:
-                if attempt < MAX_RETRIES - 1:
-                    delay = 2 ** attempt
-                    logger.warning(f"Telegram send failed, retrying in {delay}s: {e}")
-                    time.sleep(delay)
-                else:
-                    logger.error(f"Failed to send Telegram message after {MAX_RETRIES} attempts: {e}")
-                    return False
-        return False
+    def _enqueue(self, kind: str, fields: dict) -> bool:
+        """Hand a notification to the worker without blocking."""
+        if not self._accepting:
+            if self._closed:
+                logger.warning(f"Telegram notifier is closed, dropping {kind} notification")
+            return False
+        try:
+            self._q.put_nowait((kind, fields))
+            return True
+        except queue.Full:
+            logger.warning(f"Telegram queue full, dropping {kind} notification")
+            return False
 
-    def notify_trade(
+    def _deliver(self, message: str, parse_mode: str) -> str:
+        """Send a message to Telegram with rate limiting and retries; returns a SEND_* status."""
+        self._acquire_token()
+
+        payload = {**self._base_payload, "text": message}
+        if parse_mode != "HTML":
+            payload["parse_mode"] = parse_mode
+        # Serialize once up front instead of form-encoding on every retry
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+        try:
+            response = self._session.post(self._send_url, data=body, timeout=10)
+            response.raise_for_status()
+            logger.debug(f"Telegram message sent: {message[:50]}...")
+            return SEND_OK
+        except requests.exceptions.HTTPError as e:
+            logger.error(f"Failed to send Telegram message: {e}")
+            if e.response is not None and e.response.status_code == 400:
+                return SEND_REJECTED
+            return SEND_FAILED
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Failed to send Telegram message: {e}")
+            return SEND_FAILED
+
+    def _format_trade(
         self,
         ticker: str,
         action: str,
@@ -97,12 +319,13 @@ class TelegramNotifier:
         ai_score: Optional[int] = None,
         reason: Optional[str] = None,
         avg_cost: Optional[float] = None,
-    ) -> bool:
-        """Send trade notification."""
+    ) -> str:
+        """Format trade notification."""
         total = quantity * price
+        action = action.upper()
 
         # Determine emoji and title based on action and reason
-        if action.upper() == "BUY":
+        if action == "BUY":
             emoji = "🟢"
             title = "Trade Executed"
         else:
@@ -118,113 +341,159 @@ class TelegramNotifier:
                 emoji = "🔴"
                 title = "Trade Executed"
 
-        message = f"""
-{emoji} <b>{title}</b>
-
-<b>Ticker:</b> {ticker}
-<b>Action:</b> {action.upper()}
-<b>Quantity:</b> {quantity} shares
-<b>Price:</b> ${price:.2f}
-<b>Total:</b> ${total:,.2f}
-"""
+        parts = [self._render(
+            self._TRADE_TMPL,
+            emoji=emoji,
+            title=title,
+            ticker=ticker,
+            action=action,
+            quantity=quantity,
+            price=price,
+            total=total,
+        )]
         # Show P&L for sell orders
-        if action.upper() == "SELL" and avg_cost is not None:
+        if action == "SELL" and avg_cost is not None:
             pnl = (price - avg_cost) * quantity
             pnl_pct = ((price - avg_cost) / avg_cost) * 100
-            pnl_emoji = "📈" if pnl >= 0 else "📉"
-            pnl_sign = "+" if pnl >= 0 else ""
-            message += f"<b>Avg Cost:</b> ${avg_cost:.2f}\n"
-            message += f"<b>P&L:</b> {pnl_emoji} {pnl_sign}${pnl:,.2f} ({pnl_sign}{pnl_pct:.1f}%)\n"
+            parts.append(self._PNL_TMPL.format(
+                avg_cost=avg_cost,
+                emoji="📈" if pnl >= 0 else "📉",
+                sign="+" if pnl >= 0 else "",
+                pnl=pnl,
+                pnl_pct=pnl_pct,
+            ))
 
         if ai_score is not None:
-            message += f"<b>AI Score:</b> {ai_score}/10\n"
+            parts.append(self._AI_SCORE_LINE.format(ai_score=ai_score))
         if reason:
-            message += f"<b>Reason:</b> {reason}\n"
+            parts.append(self._render(self._REASON_LINE, reason=reason))
 
-        return self.send_message(message.strip())
+        return "".join(parts)
 
-    def notify_signal(
+    def _format_signal(
         self,
         ticker: str,
         signal_type: str,
         ai_score: int,
         current_price: Optional[float] = None,
         target_price: Optional[float] = None,
-    ) -> bool:
-        """Send trading signal notification."""
-        emoji = "📈" if signal_type == "BUY" else "📉"
-
-        message = f"""
-{emoji} <b>Trading Signal: {signal_type}</b>
-
-<b>Ticker:</b> {ticker}
-<b>AI Score:</b> {ai_score}/10
-"""
+    ) -> str:
+        """Format trading signal notification."""
+        parts = [self._render(
+            self._SIGNAL_TMPL,
+            emoji="📈" if signal_type == "BUY" else "📉",
+            signal_type=signal_type,
+            ticker=ticker,
+            ai_score=ai_score,
+        )]
         if current_price:
-            message += f"<b>Current Price:</b> ${current_price:.2f}\n"
+            parts.append(self._CURRENT_PRICE_LINE.format(price=current_price))
         if target_price:
-            message += f"<b>Target Price:</b> ${target_price:.2f}\n"
+            parts.append(self._TARGET_PRICE_LINE.format(price=target_price))
 
-        return self.send_message(message.strip())
+        return "".join(parts)
 
-    def notify_error(self, error_message: str) -> bool:
-        """Send error notification."""
+    def _format_error(self, error_message: str) -> str:
+        """Format error notification."""
         # Escape HTML in error message
-        safe_message = html.escape(str(error_message))
-        message = f"""
-⚠️ <b>Trading System Error</b>
-
-{safe_message}
-"""
-        return self.send_message(message.strip())
+        return self._ERROR_TMPL.format(msg=html.escape(str(error_message)))
 
-    def notify_daily_summary(
+    def _format_daily_summary(
         self,
         positions: list[dict],
         total_value: float,
         daily_pnl: float,
-    ) -> bool:
-        """Send daily summary notification."""
-        pnl_emoji = "📈" if daily_pnl >= 0 else "📉"
-        pnl_sign = "+" if daily_pnl >= 0 else ""
-
-        message = f"""
-📊 <b>Daily Summary</b>
-
-<b>Total Value:</b> ${total_value:,.2f}
-<b>Daily P&L:</b> {pnl_emoji} {pnl_sign}${daily_pnl:,.2f}
-<b>Positions:</b> {len(positions)}
-"""
+    ) -> str:
+        """Format daily summary notification."""
+        parts = [self._SUMMARY_TMPL.format(
+            total_value=total_value,
+            emoji="📈" if daily_pnl >= 0 else "📉",
+            sign="+" if daily_pnl >= 0 else "",
+            daily_pnl=daily_pnl,
+            count=len(positions),
+        )]
         if positions:
-            message += "\n<b>Holdings:</b>\n"
+            parts.append(self._HOLDINGS_HEADER)
             for pos in positions[:5]:  # Show top 5
-                message += f"  • {pos['ticker']}: {pos['quantity']} shares\n"
+                parts.append(self._render(self._HOLDING_LINE, ticker=pos["ticker"], quantity=pos["quantity"]))
             if len(positions) > 5:
-                message += f"  ... and {len(positions) - 5} more\n"
+                parts.append(self._HOLDINGS_MORE.format(count=len(positions) - 5))
 
-        return self.send_message(message.strip())
+        return "".join(parts)
 
-    def notify_startup(self, is_simulation: bool) -> bool:
-        """Send startup notification."""
-        mode = "SIMULATION" if is_simulation else "LIVE"
-        emoji = "🧪" if is_simulation else "🚀"
+    def _format_startup(self, is_simulation: bool) -> str:
+        """Format startup notification."""
+        return self._STARTUP_TMPL.format(
+            emoji="🧪" if is_simulation else "🚀",
+            mode="SIMULATION" if is_simulation else "LIVE",
+        )
+
+    def notify_trade(
+        self,
+        ticker: str,
+        action: str,
+        quantity: int,
+        price: float,
+        ai_score: Optional[int] = None,
+        reason: Optional[str] = None,
+        avg_cost: Optional[float] = None,
+    ) -> bool:
+        """Send trade notification."""
+        return self._enqueue("trade", {
+            "ticker": ticker,
+            "action": action,
+            "quantity": quantity,
+            "price": price,
+            "ai_score": ai_score,
+            "reason": reason,
+            "avg_cost": avg_cost,
+        })
+
+    def notify_signal(
+        self,
+        ticker: str,
+        signal_type: str,
+        ai_score: int,
+        current_price: Optional[float] = None,
+        target_price: Optional[float] = None,
+    ) -> bool:
+        """Send trading signal notification."""
+        return self._enqueue("signal", {
+            "ticker": ticker,
+            "signal_type": signal_type,
+            "ai_score": ai_score,
+            "current_price": current_price,
+            "target_price": target_price,
+        })
 
-        message = f"""
-{emoji} <b>Trading System Started</b>
+    def notify_error(self, error_message: str) -> bool:
+        """Send error notification."""
+        return self._enqueue("error", {"error_message": error_message})
 
-<b>Mode:</b> {mode}
-<b>Status:</b> Running
-"""
-        return self.send_message(message.strip())
+    def notify_daily_summary(
+        self,
+        positions: list[dict],
+        total_value: float,
+        daily_pnl: float,
+    ) -> bool:
+        """Send daily summary notification."""
+        # Formatting happens later on the worker thread; copy the list so later
+        # changes by the caller don't leak into the message (the dicts are shared)
+        return self._enqueue("daily_summary", {
+            "positions": list(positions),
+            "total_value": total_value,
+            "daily_pnl": daily_pnl,
+        })
+
+    def notify_startup(self, is_simulation: bool) -> bool:
+        """Send startup notification."""
+        return self._enqueue("startup", {"is_simulation": is_simulation})
 
     def notify_shutdown(self) -> bool:
         """Send shutdown notification."""
-        message = """
-🛑 <b>Trading System Stopped</b>
-
-The trading system has been shut down.
-"""
-        return self.send_message(message.strip())
+        result = self.send_message(self._SHUTDOWN_MSG)
+        self.close()
+        return result
 
 
 # Singleton instance